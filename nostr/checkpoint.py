@@ -0,0 +1,98 @@
+import copy
+import sqlite3
+import time
+from threading import Lock
+from .filter import Filters
+
+
+class SubscriptionCheckpoints:
+    """ Persists per-(relay, subscription) resume points in SQLite; they only advance after EOSE
+    since stored events arrive newest-first """
+    def __init__(self, path: str, overlap_secs: int=60, flush_interval: float=5.0) -> None:
+        self.overlap_secs = overlap_secs
+        self.flush_interval = flush_interval
+        self.lock = Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS checkpoints ("
+            "url TEXT NOT NULL, subscription_id TEXT NOT NULL, created_at INTEGER, eose INTEGER NOT NULL, "
+            "PRIMARY KEY (url, subscription_id))")
+        self._db.commit()
+
+        self._checkpoints: dict[tuple[str, str], list] = {}  # (url, id) -> [created_at, eose]
+        for url, subscription_id, created_at, eose in self._db.execute("SELECT * FROM checkpoints"):
+            self._checkpoints[(url, subscription_id)] = [created_at, bool(eose)]
+        self._pending: dict[tuple[str, str], int] = {}  # newest created_at seen before EOSE
+        self._dirty: set = set()
+        self._last_flush = time.monotonic()
+
+    def get(self, url: str, subscription_id: str) -> "tuple[int, bool]":
+        """ (resume created_at or None, whether EOSE was seen) """
+        with self.lock:
+            created_at, eose = self._checkpoints.get((url, subscription_id), [None, False])
+            return created_at, eose
+
+    def start(self, url: str, subscription_id: str):
+        """ Called when a REQ is (re)sent; events are stored-phase until the next EOSE """
+        key = (url, subscription_id)
+        with self.lock:
+            self._checkpoints.setdefault(key, [None, False])[1] = False
+            self._pending.pop(key, None)
+            self._dirty.add(key)
+
+    def update(self, url: str, subscription_id: str, created_at: int):
+        key = (url, subscription_id)
+        # never resume past the time the event was received, whatever it claims
+        created_at = min(created_at, int(time.time()))
+        with self.lock:
+            checkpoint = self._checkpoints.setdefault(key, [None, False])
+            if checkpoint[1]:
+                if checkpoint[0] is None or created_at > checkpoint[0]:
+                    checkpoint[0] = created_at
+                    self._dirty.add(key)
+            elif created_at > self._pending.get(key, -1):
+                self._pending[key] = created_at
+        self._maybe_flush()
+
+    def mark_eose(self, url: str, subscription_id: str):
+        key = (url, subscription_id)
+        with self.lock:
+            checkpoint = self._checkpoints.setdefault(key, [None, False])
+            checkpoint[1] = True
+            pending = self._pending.pop(key, None)
+            if pending is not None and (checkpoint[0] is None or pending > checkpoint[0]):
+                checkpoint[0] = pending
+            self._dirty.add(key)
+        self.flush()
+
+    def resume_filters(self, url: str, subscription_id: str, filters: Filters) -> Filters:
+        """ Copies `filters` with `since` moved up to the checkpoint minus the overlap window """
+        created_at, _ = self.get(url, subscription_id)
+        if created_at is None:
+            return filters
+
+        since = created_at - self.overlap_secs
+        resumed = Filters()
+        for filter in filters:
+            filter = copy.copy(filter)
+            if filter.since is None or filter.since < since:
+                filter.since = since
+            resumed.append(filter)
+        return resumed
+
+    def flush(self):
+        with self.lock:
+            rows = [(url, id, *self._checkpoints[(url, id)]) for url, id in self._dirty]
+            self._dirty.clear()
+            self._last_flush = time.monotonic()
+            if rows:
+                self._db.executemany("INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?)", rows)
+                self._db.commit()
+
+    def close(self):
+        self.flush()
+        self._db.close()
+
+    def _maybe_flush(self):
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
@@ -1,5 +1,10 @@
 import time
-from dataclasses import dataclass
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from hashlib import sha256
+from threading import Lock
+from secp256k1 import PublicKey
+from .event import Event
 
 
 @dataclass
@@ -9,18 +14,19 @@ class Delegation:
     event_kind: int
     duration_secs: int = 30*24*60  # default to 30 days
     signature: str = None  # set in PrivateKey.sign_delegation
+    expires: int = field(default=None)  # fixed at creation so the signed token doesn't drift
+
+    def __post_init__(self):
+        if self.expires is None:
+            self.expires = int(time.time()) + self.duration_secs
 
-    @property
-    def expires(self) -> int:
-        return int(time.time()) + self.duration_secs
-    
     @property
     def conditions(self) -> str:
         return f"kind={self.event_kind}&created_at<{self.expires}"
-    
+
     @property
     def delegation_token(self) -> str:
-        return f"nostr:delegation:{self.delegatee_pubkey}:{self.conditions}"
+        return delegation_token(self.delegatee_pubkey, self.conditions)
 
     def get_tag(self) -> list[str]:
         """ Called by Event """
@@ -30,3 +36,84 @@ class Delegation:
             self.conditions,
             self.signature,
         ]
+
+
+def delegation_token(delegatee_pubkey: str, conditions: str) -> str:
+    return f"nostr:delegation:{delegatee_pubkey}:{conditions}"
+
+
+def get_delegation_tag(event: Event) -> "list[str]":
+    for tag in event.tags:
+        if len(tag) > 0 and tag[0] == "delegation":
+            return tag
+    return None
+
+
+def conditions_match(conditions: str, event: Event) -> bool:
+    """ Checks an event against a NIP-26 conditions query string; kinds are OR'd, everything else AND'd """
+    kinds = []
+    for condition in conditions.split("&"):
+        try:
+            if condition.startswith("kind="):
+                kinds.append(int(condition[len("kind="):]))
+            elif condition.startswith("created_at<"):
+                if not event.created_at < int(condition[len("created_at<"):]):
+                    return False
+            elif condition.startswith("created_at>"):
+                if not event.created_at > int(condition[len("created_at>"):]):
+                    return False
+            else:
+                return False
+        except ValueError:
+            return False
+
+    if kinds and event.kind not in kinds:
+        return False
+    return True
+
+
+class DelegationValidator:
+    """ Validates NIP-26 delegation tags on incoming events
+
+    Token signatures are checked once per (delegator, delegatee, conditions, sig)
+    and the result kept in a bounded LRU cache; the conditions themselves are
+    re-checked against every event.
+    """
+    def __init__(self, max_cache_size: int=4096) -> None:
+        self.max_cache_size = max_cache_size
+        self._cache: OrderedDict[tuple, bool] = OrderedDict()
+        self.lock = Lock()
+
+    def validate(self, event: Event) -> bool:
+        """ Returns True if the event carries no delegation tag or a valid one """
+        tag = get_delegation_tag(event)
+        if tag is None:
+            return True
+        if len(tag) != 4:
+            return False
+
+        _, delegator_pubkey, conditions, signature = tag
+        if not conditions_match(conditions, event):
+            return False
+
+        return self._verify_token(delegator_pubkey, event.public_key, conditions, signature)
+
+    def _verify_token(self, delegator_pubkey: str, delegatee_pubkey: str, conditions: str, signature: str) -> bool:
+        key = (delegator_pubkey, delegatee_pubkey, conditions, signature)
+        with self.lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        token_hash = sha256(delegation_token(delegatee_pubkey, conditions).encode()).digest()
+        try:
+            pub_key = PublicKey(bytes.fromhex("02" + delegator_pubkey), True) # add 02 for schnorr (bip340)
+            is_valid = pub_key.schnorr_verify(token_hash, bytes.fromhex(signature), None, raw=True)
+        except Exception:
+            is_valid = False
+
+        with self.lock:
+            self._cache[key] = is_valid
+            if len(self._cache) > self.max_cache_size:
+                self._cache.popitem(last=False)
+        return is_valid
@@ -0,0 +1,183 @@
+import json
+import numpy as np
+from .event import Event
+from .filter import Filter, Filters
+
+
+class EventBuffer:
+    """ Columnar, append-only store of Events for bulk filtering
+
+    ids, pubkeys and sigs are packed as raw bytes, created_at and kind as NumPy
+    arrays, and content/tags as utf-8 blobs indexed by offsets. Events are only
+    materialized when read back.
+    """
+    def __init__(self, capacity: int=1024) -> None:
+        capacity = max(capacity, 1)
+        self._size = 0
+        self._ids = np.zeros((capacity, 32), dtype=np.uint8)
+        self._pubkeys = np.zeros((capacity, 32), dtype=np.uint8)
+        self._sigs = np.zeros((capacity, 64), dtype=np.uint8)
+        self._created_at = np.zeros(capacity, dtype=np.int64)
+        self._kinds = np.zeros(capacity, dtype=np.int64)
+        self._content = _Blobs(capacity)
+        self._tags = _Blobs(capacity)
+
+    @classmethod
+    def from_events(cls, events: "list[Event]"):
+        buffer = cls(len(events))
+        buffer.extend(events)
+        return buffer
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __getitem__(self, index: int) -> Event:
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError("EventBuffer index out of range")
+
+        return Event(
+            public_key=self._pubkeys[index].tobytes().hex(),
+            content=self._content[index],
+            created_at=int(self._created_at[index]),
+            kind=int(self._kinds[index]),
+            tags=json.loads(self._tags[index]),
+            id=self._ids[index].tobytes().hex(),
+            signature=self._sigs[index].tobytes().hex() if self._sigs[index].any() else None,
+        )
+
+    def __iter__(self):
+        return self.events()
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self._ids[:self._size]
+
+    @property
+    def pubkeys(self) -> np.ndarray:
+        return self._pubkeys[:self._size]
+
+    @property
+    def sigs(self) -> np.ndarray:
+        return self._sigs[:self._size]
+
+    @property
+    def created_at(self) -> np.ndarray:
+        return self._created_at[:self._size]
+
+    @property
+    def kinds(self) -> np.ndarray:
+        return self._kinds[:self._size]
+
+    def append(self, event: Event) -> None:
+        if self._size == len(self._kinds):
+            self._grow(2 * self._size)
+
+        i = self._size
+        self._ids[i] = np.frombuffer(bytes.fromhex(event.id), dtype=np.uint8)
+        self._pubkeys[i] = np.frombuffer(bytes.fromhex(event.public_key), dtype=np.uint8)
+        if event.signature is not None:
+            self._sigs[i] = np.frombuffer(bytes.fromhex(event.signature), dtype=np.uint8)
+        else:
+            self._sigs[i] = 0
+        self._created_at[i] = event.created_at
+        self._kinds[i] = event.kind
+        self._content.append(event.content)
+        self._tags.append(json.dumps(event.tags, separators=(',', ':'), ensure_ascii=False))
+        self._size += 1
+
+    def extend(self, events: "list[Event]") -> None:
+        for event in events:
+            self.append(event)
+
+    def mask(self, filter: Filter) -> np.ndarray:
+        """ Boolean array of the rows that `filter` matches (same rules as Filter.matches) """
+        mask = np.ones(self._size, dtype=bool)
+        if filter.IDs != None:
+            mask &= _isin_hex(self.ids, filter.IDs)
+        if filter.kinds != None:
+            mask &= np.isin(self.kinds, np.asarray(filter.kinds, dtype=np.int64))
+        if filter.authors != None:
+            mask &= _isin_hex(self.pubkeys, filter.authors)
+        if filter.since != None:
+            mask &= self.created_at >= filter.since
+        if filter.until != None:
+            mask &= self.created_at <= filter.until
+        if filter.tags != None:
+            # tag values are not columnar; check the surviving rows one by one
+            for i in np.flatnonzero(mask):
+                mask[i] = filter.matches(self[i])
+
+        return mask
+
+    def match(self, filters: Filters) -> np.ndarray:
+        """ Boolean array of the rows that match any of `filters` """
+        mask = np.zeros(self._size, dtype=bool)
+        for filter in filters:
+            mask |= self.mask(filter)
+        return mask
+
+    def events(self, mask: np.ndarray=None):
+        """ Lazily materialize Events, optionally only the rows selected by `mask` """
+        indices = range(self._size) if mask is None else np.flatnonzero(mask)
+        for i in indices:
+            yield self[int(i)]
+
+    def _grow(self, capacity: int) -> None:
+        capacity = max(capacity, 1)
+        self._ids = _resized(self._ids, capacity)
+        self._pubkeys = _resized(self._pubkeys, capacity)
+        self._sigs = _resized(self._sigs, capacity)
+        self._created_at = _resized(self._created_at, capacity)
+        self._kinds = _resized(self._kinds, capacity)
+
+
+class _Blobs:
+    """ Variable-length utf-8 strings packed into one byte buffer plus offsets """
+    def __init__(self, capacity: int) -> None:
+        self._data = np.zeros(capacity * 64, dtype=np.uint8)
+        self._offsets = np.zeros(capacity + 1, dtype=np.int64)
+        self._size = 0
+
+    def __getitem__(self, index: int) -> str:
+        start, end = self._offsets[index], self._offsets[index + 1]
+        return self._data[start:end].tobytes().decode()
+
+    def append(self, value: str) -> None:
+        encoded = value.encode()
+        start = self._offsets[self._size]
+        end = start + len(encoded)
+        if end > len(self._data):
+            self._data = _resized(self._data, max(2 * len(self._data), end))
+        if self._size + 2 > len(self._offsets):
+            self._offsets = _resized(self._offsets, 2 * len(self._offsets))
+
+        self._data[start:end] = np.frombuffer(encoded, dtype=np.uint8)
+        self._offsets[self._size + 1] = end
+        self._size += 1
+
+
+def _resized(array: np.ndarray, length: int) -> np.ndarray:
+    resized = np.zeros((length,) + array.shape[1:], dtype=array.dtype)
+    resized[:len(array)] = array
+    return resized
+
+
+def _isin_hex(column: np.ndarray, values: "list[str]") -> np.ndarray:
+    width = column.shape[1]
+    needles = []
+    for value in values:
+        # Filter.matches compares hex strings exactly, so only canonical lowercase hex can match
+        if len(value) != 2 * width or value != value.lower():
+            continue
+        try:
+            needles.append(bytes.fromhex(value))
+        except ValueError:
+            continue
+
+    if not needles:
+        return np.zeros(len(column), dtype=bool)
+
+    haystack = np.ascontiguousarray(column).view(f"V{width}").ravel()
+    return np.isin(haystack, np.array(needles, dtype=f"V{width}"))
@@ -0,0 +1,146 @@
+from collections import OrderedDict
+from .event import Event, EventKind
+
+
+def is_replaceable(kind: int) -> bool:
+    return kind in (EventKind.SET_METADATA, EventKind.CONTACTS) or 10000 <= kind < 20000
+
+
+def is_parameterized_replaceable(kind: int) -> bool:
+    return 30000 <= kind < 40000
+
+
+def get_d_tag(event: Event) -> str:
+    for tag in event.tags:
+        if len(tag) > 0 and tag[0] == "d":
+            return tag[1] if len(tag) > 1 else ""
+    return ""
+
+
+class EventState:
+    """ Drops replaceable events older than the newest seen and events deleted by their author
+
+    Only (created_at, id) is kept per replaceable key, and each table is an LRU capped at
+    `max_entries`; once a key or deletion is evicted, an old version may be delivered again.
+    """
+    def __init__(self, max_entries: int=100000) -> None:
+        self.max_entries = max_entries
+        self._latest: OrderedDict[tuple, tuple[int, str]] = OrderedDict()  # key -> (created_at, id)
+        self._latest_keys: dict[str, tuple] = {}  # event id -> key in _latest
+        self._deleted_ids: OrderedDict[str, set[str]] = OrderedDict()  # event id -> pubkeys that sent a deletion for it
+        self._deleted_addresses: OrderedDict[tuple, int] = OrderedDict()  # (kind, pubkey, d) -> deletion created_at
+
+    def process(self, event: Event) -> bool:
+        """ Updates the state with `event`; returns False if it should not be delivered """
+        if self.is_deleted(event):
+            return False
+
+        if event.kind == EventKind.DELETE:
+            self._apply_deletion(event)
+            return True
+
+        key = self._replaceable_key(event)
+        if key is None:
+            return True
+
+        current = self._latest.get(key)
+        if current is not None and not _is_newer((event.created_at, event.id), current):
+            self._latest.move_to_end(key)
+            return False
+
+        self._set_latest(key, (event.created_at, event.id))
+        return True
+
+    def is_deleted(self, event: Event) -> bool:
+        # only a deletion from the event's own author counts
+        if event.public_key in self._deleted_ids.get(event.id, ()):
+            return True
+
+        if is_parameterized_replaceable(event.kind) or is_replaceable(event.kind):
+            d = get_d_tag(event) if is_parameterized_replaceable(event.kind) else ""
+            deleted_at = self._deleted_addresses.get((event.kind, event.public_key, d))
+            if deleted_at is not None and event.created_at <= deleted_at:
+                return True
+
+        return False
+
+    def get_latest_id(self, public_key: str, kind: int, d: str="") -> str:
+        """ Id of the newest known version of a replaceable event, or None """
+        key = (public_key, kind, d) if is_parameterized_replaceable(kind) else (public_key, kind)
+        latest = self._latest.get(key)
+        return latest[1] if latest is not None else None
+
+    def _replaceable_key(self, event: Event) -> tuple:
+        if is_replaceable(event.kind):
+            return (event.public_key, event.kind)
+        if is_parameterized_replaceable(event.kind):
+            return (event.public_key, event.kind, get_d_tag(event))
+        return None
+
+    def _apply_deletion(self, event: Event) -> None:
+        for tag in event.tags:
+            if len(tag) < 2:
+                continue
+
+            if tag[0] == "e":
+                self._deleted_ids.setdefault(tag[1], set()).add(event.public_key)
+                self._deleted_ids.move_to_end(tag[1])
+                _evict(self._deleted_ids, self.max_entries)
+                key = self._latest_keys.get(tag[1])
+                if key is not None and key[0] == event.public_key:
+                    self._remove_latest(key)
+            elif tag[0] == "a":
+                address = self._parse_address(tag[1])
+                # authors can only delete their own events
+                if address is None or address[1] != event.public_key:
+                    continue
+                kind, public_key, d = address
+                if not is_parameterized_replaceable(kind):
+                    d = ""
+                deleted_at = max(event.created_at, self._deleted_addresses.get((kind, public_key, d), 0))
+                self._deleted_addresses[(kind, public_key, d)] = deleted_at
+                self._deleted_addresses.move_to_end((kind, public_key, d))
+                _evict(self._deleted_addresses, self.max_entries)
+
+                key = (public_key, kind, d) if is_parameterized_replaceable(kind) else (public_key, kind)
+                latest = self._latest.get(key)
+                if latest is not None and latest[0] <= deleted_at:
+                    self._remove_latest(key)
+
+    def _set_latest(self, key: tuple, latest: "tuple[int, str]") -> None:
+        self._remove_latest(key)
+        self._latest[key] = latest
+        self._latest_keys[latest[1]] = key
+        while len(self._latest) > self.max_entries:
+            _, (_, id) = self._latest.popitem(last=False)
+            self._latest_keys.pop(id, None)
+
+    def _remove_latest(self, key: tuple) -> None:
+        current = self._latest.pop(key, None)
+        if current is not None:
+            self._latest_keys.pop(current[1], None)
+
+    @staticmethod
+    def _parse_address(address: str) -> tuple:
+        """ "<kind>:<pubkey>:<d tag>" -> (kind, pubkey, d) """
+        parts = address.split(":", 2)
+        if len(parts) != 3:
+            return None
+        try:
+            return (int(parts[0]), parts[1], parts[2])
+        except ValueError:
+            return None
+
+
+def _evict(table: OrderedDict, max_entries: int) -> None:
+    while len(table) > max_entries:
+        table.popitem(last=False)
+
+
+def _is_newer(latest: "tuple[int, str]", current: "tuple[int, str]") -> bool:
+    created_at, id = latest
+    current_created_at, current_id = current
+    if created_at != current_created_at:
+        return created_at > current_created_at
+    # same timestamp: the lowest id wins
+    return id < current_id
@@ -2,13 +2,17 @@ import json
 from queue import Queue
 from threading import Lock
 from .message_type import RelayMessageType
+from .checkpoint import SubscriptionCheckpoints
 from .event import Event
+from .event_state import EventState
+from .tracing import MessageTrace, TraceStage
 
 class EventMessage:
-    def __init__(self, event: Event, subscription_id: str, url: str) -> None:
+    def __init__(self, event: Event, subscription_id: str, url: str, trace: MessageTrace=None) -> None:
         self.event = event
         self.subscription_id = subscription_id
         self.url = url
+        self.trace = trace
 
 class NoticeMessage:
     def __init__(self, content: str, url: str) -> None:
@@ -20,19 +24,45 @@ class EndOfStoredEventsMessage:
         self.subscription_id = subscription_id
         self.url = url
 
+class NegentropyMessage:
+    def __init__(self, subscription_id: str, content, url: str, is_error: bool=False) -> None:
+        self.subscription_id = subscription_id
+        self.content = content
+        self.url = url
+        self.is_error = is_error
+
 class MessagePool:
-    def __init__(self) -> None:
+    def __init__(self, event_state: EventState=None, checkpoints: SubscriptionCheckpoints=None) -> None:
         self.events: Queue[EventMessage] = Queue()
         self.notices: Queue[NoticeMessage] = Queue()
         self.eose_notices: Queue[EndOfStoredEventsMessage] = Queue()
+        self._negentropy_sessions: dict[tuple[str, str], Queue] = {}
         self._unique_events: set = set()
+        self.event_state = event_state
+        self.checkpoints = checkpoints
         self.lock: Lock = Lock()
     
-    def add_message(self, message: str, url: str):
-        self._process_message(message, url)
+    def add_message(self, message: str, url: str, trace: MessageTrace=None):
+        self._process_message(message, url, trace)
+
+    def add_batch(self, messages: "list"):
+        """ Adds already-parsed messages, e.g. from a RelayShard """
+        for message in messages:
+            if isinstance(message, EventMessage):
+                self._add_event(message.event, message.subscription_id, message.url)
+            elif isinstance(message, NoticeMessage):
+                self.notices.put(message)
+            elif isinstance(message, EndOfStoredEventsMessage):
+                self._add_eose_notice(message)
+            elif isinstance(message, NegentropyMessage):
+                self._add_negentropy_message(message)
 
     def get_event(self):
-        return self.events.get()
+        event_message = self.events.get()
+        if event_message.trace is not None:
+            event_message.trace.mark(TraceStage.QUEUE_WAIT)
+            event_message.trace.finish()
+        return event_message
 
     def get_notice(self):
         return self.notices.get()
@@ -40,6 +70,17 @@ class MessagePool:
     def get_eose_notice(self):
         return self.eose_notices.get()
 
+    def open_negentropy_session(self, url: str, subscription_id: str) -> Queue:
+        """ Replies for (url, subscription_id) go to the returned queue; replies with no open session are dropped """
+        session = Queue()
+        with self.lock:
+            self._negentropy_sessions[(url, subscription_id)] = session
+        return session
+
+    def close_negentropy_session(self, url: str, subscription_id: str):
+        with self.lock:
+            self._negentropy_sessions.pop((url, subscription_id), None)
+
     def has_events(self):
         return self.events.qsize() > 0
 
@@ -49,20 +90,54 @@ class MessagePool:
     def has_eose_notices(self):
         return self.eose_notices.qsize() > 0
 
-    def _process_message(self, message: str, url: str):
+    def _process_message(self, message: str, url: str, trace: MessageTrace=None):
         message_json = json.loads(message)
         message_type = message_json[0]
         if message_type == RelayMessageType.EVENT:
             subscription_id = message_json[1]
             e = message_json[2]
             event = Event(e['pubkey'], e['content'], e['created_at'], e['kind'], e['tags'], e['id'], e['sig'])
-            with self.lock:
-                if not event.id in self._unique_events:
-                    self.events.put(EventMessage(event, subscription_id, url))
-                    self._unique_events.add(event.id)
+            if trace is not None:
+                trace.mark(TraceStage.POOL_PARSE)
+            self._add_event(event, subscription_id, url, trace)
+            return
         elif message_type == RelayMessageType.NOTICE:
             self.notices.put(NoticeMessage(message_json[1], url))
         elif message_type == RelayMessageType.END_OF_STORED_EVENTS:
-            self.eose_notices.put(EndOfStoredEventsMessage(message_json[1], url))
+            self._add_eose_notice(EndOfStoredEventsMessage(message_json[1], url))
+        elif message_type == RelayMessageType.RECONCILE_MSG:
+            self._add_negentropy_message(NegentropyMessage(message_json[1], message_json[2], url))
+        elif message_type == RelayMessageType.RECONCILE_ERR:
+            self._add_negentropy_message(NegentropyMessage(message_json[1], message_json[2], url, is_error=True))
+
+        if trace is not None:
+            trace.finish()
+
+    def _add_event(self, event: Event, subscription_id: str, url: str, trace: MessageTrace=None):
+        if self.checkpoints is not None:
+            self.checkpoints.update(url, subscription_id, event.created_at)
+        with self.lock:
+            if trace is not None:
+                trace.mark(TraceStage.DEDUP_LOCK)
+            if not event.id in self._unique_events:
+                self._unique_events.add(event.id)
+                if self.event_state is None or self.event_state.process(event):
+                    if trace is not None:
+                        trace.mark(TraceStage.DEDUP)
+                    self.events.put(EventMessage(event, subscription_id, url, trace))
+                    return
+
+        if trace is not None:
+            trace.mark(TraceStage.DEDUP)
+            trace.finish()
 
+    def _add_eose_notice(self, eose_notice: EndOfStoredEventsMessage):
+        if self.checkpoints is not None:
+            self.checkpoints.mark_eose(eose_notice.url, eose_notice.subscription_id)
+        self.eose_notices.put(eose_notice)
 
+    def _add_negentropy_message(self, message: NegentropyMessage):
+        with self.lock:
+            session = self._negentropy_sessions.get((message.url, message.subscription_id))
+        if session is not None:
+            session.put(message)
@@ -2,14 +2,23 @@ class ClientMessageType:
     EVENT = "EVENT"
     REQUEST = "REQ"
     CLOSE = "CLOSE"
+    # Set reconciliation with this library's JSON range encoding; deliberately
+    # not the NIP-77 NEG-* verbs, whose payload is a binary format
+    RECONCILE_OPEN = "RECONCILE-OPEN"
+    RECONCILE_MSG = "RECONCILE-MSG"
+    RECONCILE_CLOSE = "RECONCILE-CLOSE"
 
 class RelayMessageType:
     EVENT = "EVENT"
     NOTICE = "NOTICE"
     END_OF_STORED_EVENTS = "EOSE"
+    RECONCILE_MSG = "RECONCILE-MSG"
+    RECONCILE_ERR = "RECONCILE-ERR"
 
     @staticmethod
     def is_valid(type: str) -> bool:
         if type == RelayMessageType.EVENT or type == RelayMessageType.NOTICE or type == RelayMessageType.END_OF_STORED_EVENTS:
             return True
+        if type == RelayMessageType.RECONCILE_MSG or type == RelayMessageType.RECONCILE_ERR:
+            return True
         return False
\ No newline at end of file
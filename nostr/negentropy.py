@@ -0,0 +1,97 @@
+from bisect import bisect_left
+from hashlib import sha256
+from .event import Event
+
+
+class NegentropyMode:
+    SKIP = "skip"
+    FINGERPRINT = "fingerprint"
+    ID_LIST = "ids"
+
+
+class Negentropy:
+    """ Range-based set reconciliation over (created_at, id) sorted events; matching ranges are
+    skipped and mismatching ones split until ids are exchanged, filling `have_ids`/`need_ids` """
+    def __init__(
+            self,
+            items: "list[tuple[int, str]]",
+            is_initiator: bool=True,
+            id_list_threshold: int=32,
+            branching: int=16) -> None:
+        self.items = sorted(items)
+        self.is_initiator = is_initiator
+        self.id_list_threshold = id_list_threshold
+        self.branching = branching
+        self.have_ids: set[str] = set()
+        self.need_ids: set[str] = set()
+
+        self._prefix_sums = [0]
+        for _, id in self.items:
+            self._prefix_sums.append((self._prefix_sums[-1] + int(id, 16)) % 2**256)
+
+    @classmethod
+    def from_events(cls, events: "list[Event]", **kwargs):
+        return cls([(event.created_at, event.id) for event in events], **kwargs)
+
+    def initiate(self) -> list:
+        return self._split(0, len(self.items), None)
+
+    def reconcile(self, message: list) -> list:
+        output = []
+        lo = 0
+        for upper, mode, value in message:
+            hi = len(self.items) if upper is None else bisect_left(self.items, tuple(upper))
+
+            if mode == NegentropyMode.SKIP:
+                output.append([upper, NegentropyMode.SKIP, None])
+            elif mode == NegentropyMode.FINGERPRINT:
+                if self.fingerprint(lo, hi) == value:
+                    output.append([upper, NegentropyMode.SKIP, None])
+                else:
+                    output.extend(self._split(lo, hi, upper))
+            elif mode == NegentropyMode.ID_LIST:
+                ours = {id for _, id in self.items[lo:hi]}
+                if self.is_initiator:
+                    theirs = set(value)
+                    self.have_ids |= ours - theirs
+                    self.need_ids |= theirs - ours
+                    output.append([upper, NegentropyMode.SKIP, None])
+                else:
+                    output.append([upper, NegentropyMode.ID_LIST, sorted(ours)])
+            else:
+                raise ValueError(f"Unknown negentropy range mode: {mode}")
+
+            lo = hi
+
+        return _compress(output)
+
+    def fingerprint(self, lo: int, hi: int) -> str:
+        """ Hash of the sum of ids (mod 2**256) and the count of items[lo:hi] """
+        id_sum = (self._prefix_sums[hi] - self._prefix_sums[lo]) % 2**256
+        return sha256(id_sum.to_bytes(32, "little") + (hi - lo).to_bytes(8, "little")).hexdigest()[:32]
+
+    def _split(self, lo: int, hi: int, upper: list) -> list:
+        if hi - lo <= self.id_list_threshold:
+            return [[upper, NegentropyMode.ID_LIST, [id for _, id in self.items[lo:hi]]]]
+
+        ranges = []
+        bucket_size = -(-(hi - lo) // self.branching)
+        for start in range(lo, hi, bucket_size):
+            end = min(start + bucket_size, hi)
+            bucket_upper = list(self.items[end]) if end < hi else upper
+            ranges.append([bucket_upper, NegentropyMode.FINGERPRINT, self.fingerprint(start, end)])
+        return ranges
+
+
+def _compress(ranges: list) -> list:
+    """ Merges consecutive skips and drops trailing ones; nothing left means nothing to do """
+    compressed = []
+    for upper, mode, value in ranges:
+        if mode == NegentropyMode.SKIP and compressed and compressed[-1][1] == NegentropyMode.SKIP:
+            compressed[-1][0] = upper
+        else:
+            compressed.append([upper, mode, value])
+
+    while compressed and compressed[-1][1] == NegentropyMode.SKIP:
+        compressed.pop()
+    return compressed
@@ -1,11 +1,13 @@
 import json
 from threading import Lock
 from websocket import WebSocketApp
+from .delegation import DelegationValidator
 from .event import Event
 from .filter import Filters
 from .message_pool import MessagePool
-from .message_type import RelayMessageType
+from .message_type import ClientMessageType, RelayMessageType
 from .subscription import Subscription
+from .tracing import LatencyTracer, MessageTrace, TraceStage
 
 class RelayPolicy:
     def __init__(self, should_read: bool=True, should_write: bool=True) -> None:
@@ -24,11 +26,16 @@ class Relay:
             url: str, 
             policy: RelayPolicy, 
             message_pool: MessagePool,
-            subscriptions: dict[str, Subscription]={}) -> None:
+            subscriptions: dict[str, Subscription]={},
+            delegation_validator: DelegationValidator=None,
+            tracer: LatencyTracer=None) -> None:
         self.url = url
         self.policy = policy
         self.message_pool = message_pool
         self.subscriptions = subscriptions
+        self.delegation_validator = delegation_validator or DelegationValidator()
+        self.tracer = tracer
+        self._close_on_eose: set[str] = set()
         self.lock = Lock()
         self.ws = WebSocketApp(
             url,
@@ -46,12 +53,18 @@ class Relay:
     def publish(self, message: str):
         self.ws.send(message)
 
-    def add_subscription(self, id, filters: Filters):
+    def add_subscription(self, id, filters: Filters, close_on_eose: bool=False):
+        """ With close_on_eose the subscription is CLOSEd once the relay sends EOSE for it """
         with self.lock:
             self.subscriptions[id] = Subscription(id, filters)
+            if close_on_eose:
+                self._close_on_eose.add(id)
+            else:
+                self._close_on_eose.discard(id)
 
     def close_subscription(self, id: str) -> None:
         with self.lock:
+            self._close_on_eose.discard(id)
             self.subscriptions.pop(id)
 
     def update_subscription(self, id: str, filters: Filters) -> None:
@@ -73,18 +86,37 @@ class Relay:
         pass
 
     def _on_message(self, class_obj, message: str):
-        if self._is_valid_message(message):
-            self.message_pool.add_message(message, self.url)
+        trace = self.tracer.start(self.url) if self.tracer is not None else None
+        if self._is_valid_message(message, trace):
+            self.message_pool.add_message(message, self.url, trace)
+            if self._close_on_eose:
+                self._close_if_finished(message)
+        elif trace is not None:
+            trace.finish()
     
     def _on_error(self, class_obj, error):
         pass
 
-    def _is_valid_message(self, message: str) -> bool:
+    def _close_if_finished(self, message: str):
+        message_json = json.loads(message)
+        if message_json[0] != RelayMessageType.END_OF_STORED_EVENTS:
+            return
+
+        subscription_id = message_json[1]
+        with self.lock:
+            if subscription_id not in self._close_on_eose:
+                return
+        self.close_subscription(subscription_id)
+        self.publish(json.dumps([ClientMessageType.CLOSE, subscription_id]))
+
+    def _is_valid_message(self, message: str, trace: MessageTrace=None) -> bool:
         message = message.strip("\n")
         if not message or message[0] != '[' or message[-1] != ']':
             return False
 
         message_json = json.loads(message)
+        if trace is not None:
+            trace.mark(TraceStage.PARSE)
         message_type = message_json[0]
         if not RelayMessageType.is_valid(message_type):
             return False
@@ -99,13 +131,24 @@ class Relay:
 
             e = message_json[2]
             event = Event(e['pubkey'], e['content'], e['created_at'], e['kind'], e['tags'], e['id'], e['sig'])
+            if trace is not None:
+                trace.mark(TraceStage.EVENT)
             if not event.verify():
                 return False
+            if trace is not None:
+                trace.mark(TraceStage.VERIFY)
+
+            if not self.delegation_validator.validate(event):
+                return False
+            if trace is not None:
+                trace.mark(TraceStage.DELEGATION)
 
             with self.lock:
                 subscription = self.subscriptions[subscription_id]
 
             if not subscription.filters.match(event):
                 return False
+            if trace is not None:
+                trace.mark(TraceStage.FILTER)
 
         return True
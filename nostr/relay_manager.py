@@ -1,11 +1,19 @@
 import json
+import multiprocessing
+import queue
 import threading
 
+from .checkpoint import SubscriptionCheckpoints
+from .delegation import DelegationValidator
 from .event import Event
-from .filter import Filters
+from .filter import Filter, Filters
 from .message_pool import MessagePool
 from .message_type import ClientMessageType
+from .negentropy import Negentropy
 from .relay import Relay, RelayPolicy
+from .relay_shard import RelayShard
+from .subscription import Subscription
+from .tracing import LatencyTracer
 
 
 
@@ -15,13 +23,25 @@ class RelayException(Exception):
 
 
 class RelayManager:
-    def __init__(self) -> None:
+    def __init__(
+            self,
+            message_pool: MessagePool=None,
+            tracer: LatencyTracer=None,
+            checkpoints: SubscriptionCheckpoints=None) -> None:
         self.relays: dict[str, Relay] = {}
-        self.message_pool = MessagePool()
+        self.message_pool = message_pool or MessagePool()
+        self.checkpoints = checkpoints
+        if checkpoints is not None:
+            self.message_pool.checkpoints = checkpoints
+        self.delegation_validator = DelegationValidator()
+        self.tracer = tracer
+        self._shards: list[RelayShard] = []
+        self._shard_results: multiprocessing.Queue = None
+        self._shard_collector: threading.Thread = None
 
     def add_relay(self, url: str, read: bool=True, write: bool=True, subscriptions={}):
         policy = RelayPolicy(read, write)
-        relay = Relay(url, policy, self.message_pool, subscriptions)
+        relay = Relay(url, policy, self.message_pool, subscriptions, self.delegation_validator, self.tracer)
         self.relays[url] = relay
 
     def remove_relay(self, url: str):
@@ -30,12 +50,35 @@ class RelayManager:
     def add_subscription(self, id: str, filters: Filters):
         for relay in self.relays.values():
             relay.add_subscription(id, filters)
+        for shard in self._shards:
+            shard.add_subscription(id, filters)
 
     def close_subscription(self, id: str):
         for relay in self.relays.values():
             relay.close_subscription(id)
+        for shard in self._shards:
+            shard.close_subscription(id)
+
+    def request_subscription(self, id: str):
+        """ Sends the REQ for subscription `id` to every readable relay, resuming
+        from each relay's checkpoint when checkpoints are enabled """
+        for relay in self.relays.values():
+            if not relay.policy.should_read:
+                continue
+
+            filters = relay.subscriptions[id].filters
+            if self.checkpoints is not None:
+                filters = self.checkpoints.resume_filters(relay.url, id, filters)
+                self.checkpoints.start(relay.url, id)
+            self._publish_to_relay(relay, Subscription(id, filters).to_message())
+
+    def open_connections(self, ssl_options: dict=None, num_processes: int=0):
+        """ With num_processes > 0 the relays are split across that many worker
+        processes; events are deduplicated here before reaching the message_pool """
+        if num_processes > 0:
+            self._open_sharded_connections(ssl_options, num_processes)
+            return
 
-    def open_connections(self, ssl_options: dict=None):
         for relay in self.relays.values():
             threading.Thread(
                 target=relay.connect,
@@ -44,10 +87,21 @@ class RelayManager:
             ).start()
 
     def close_connections(self):
-        for relay in self.relays.values():
-            relay.close()
+        if self._shards:
+            self._close_sharded_connections()
+        else:
+            for relay in self.relays.values():
+                relay.close()
+
+        if self.checkpoints is not None:
+            self.checkpoints.flush()
 
     def publish_message(self, message: str):
+        if self._shards:
+            for shard in self._shards:
+                shard.publish(message)
+            return
+
         for relay in self.relays.values():
             if relay.policy.should_write:
                 relay.publish(message)
@@ -61,3 +115,116 @@ class RelayManager:
             raise RelayException(f"Could not publish {event.id}: failed to verify signature {event.signature}")
 
         self.publish_message(event.to_message())
+
+    def reconcile(
+            self,
+            url: str,
+            id: str,
+            filter: Filter,
+            events: "list[Event]",
+            fetch: bool=True,
+            timeout: float=10) -> Negentropy:
+        """ Experimental: set reconciliation of `events` with the relay's events matching `filter`
+
+        Not NIP-77: the relay must speak this library's RECONCILE-* protocol (see
+        nostr/negentropy.py). Afterwards `need_ids` on the returned Negentropy are
+        the events only the relay has and `have_ids` the ones only we have. With
+        fetch=True the missing events are requested under subscription `id`,
+        which must not already be in use and is CLOSEd after EOSE.
+        """
+        relay = self.relays[url]
+        if fetch and id in relay.subscriptions:
+            raise RelayException(f"Could not reconcile with {url}: subscription {id} already exists")
+        negentropy = Negentropy.from_events([event for event in events if filter.matches(event)])
+
+        session = self.message_pool.open_negentropy_session(url, id)
+        try:
+            message = [ClientMessageType.RECONCILE_OPEN, id, filter.to_json_object(), negentropy.initiate()]
+            self._publish_to_relay(relay, json.dumps(message))
+            while True:
+                try:
+                    response = session.get(timeout=timeout)
+                except queue.Empty:
+                    raise RelayException(f"Could not reconcile with {url}: timed out waiting for a reply")
+                if response.is_error:
+                    raise RelayException(f"Could not reconcile with {url}: {response.content}")
+
+                try:
+                    reply = negentropy.reconcile(response.content)
+                except (ValueError, TypeError, KeyError, IndexError) as e:
+                    raise RelayException(f"Could not reconcile with {url}: malformed reply: {e!r}")
+                if not reply:
+                    break
+                self._publish_to_relay(relay, json.dumps([ClientMessageType.RECONCILE_MSG, id, reply]))
+        finally:
+            self.message_pool.close_negentropy_session(url, id)
+            self._publish_to_relay(relay, json.dumps([ClientMessageType.RECONCILE_CLOSE, id]))
+
+        if fetch and negentropy.need_ids:
+            filters = Filters([Filter(ids=sorted(negentropy.need_ids))])
+            shard = self._shard_for(url)
+            if shard is not None:
+                shard.add_subscription(id, filters, close_on_eose=True)
+            else:
+                relay.add_subscription(id, filters, close_on_eose=True)
+            self._publish_to_relay(relay, Subscription(id, filters).to_message())
+
+        return negentropy
+
+    def _publish_to_relay(self, relay: Relay, message: str):
+        shard = self._shard_for(relay.url)
+        if shard is not None:
+            shard.publish(message, relay.url)
+        else:
+            relay.publish(message)
+
+    def _shard_for(self, url: str) -> RelayShard:
+        for shard in self._shards:
+            if url in shard.urls:
+                return shard
+        return None
+
+    def _open_sharded_connections(self, ssl_options: dict, num_processes: int):
+        relays = list(self.relays.values())
+        num_processes = min(num_processes, len(relays))
+        if num_processes == 0:
+            return
+
+        self._shard_results = multiprocessing.Queue()
+        self._shards = [
+            RelayShard(relays[i::num_processes], self._shard_results, ssl_options)
+            for i in range(num_processes)
+        ]
+        for shard in self._shards:
+            shard.start()
+
+        self._shard_collector = threading.Thread(
+            target=self._collect_shard_results,
+            name="relay-shard-collector",
+            daemon=True)
+        self._shard_collector.start()
+
+    def _collect_shard_results(self):
+        remaining = len(self._shards)
+        while remaining > 0:
+            try:
+                batch = self._shard_results.get(timeout=1)
+            except queue.Empty:
+                if not any(shard.is_alive() for shard in self._shards):
+                    return
+                continue
+
+            if batch is None:
+                remaining -= 1
+            else:
+                self.message_pool.add_batch(batch)
+
+    def _close_sharded_connections(self):
+        for shard in self._shards:
+            shard.close()
+        self._shard_collector.join()
+        for shard in self._shards:
+            shard.join()
+        self._shards = []
+        self._shard_results = None
+        self._shard_collector = None
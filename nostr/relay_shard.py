@@ -0,0 +1,183 @@
+import multiprocessing
+import queue
+import threading
+from .delegation import DelegationValidator
+from .filter import Filters
+from .message_pool import MessagePool, NegentropyMessage, NoticeMessage
+from .relay import Relay, RelayPolicy
+
+
+class ShardCommand:
+    PUBLISH = "PUBLISH"
+    ADD_SUBSCRIPTION = "ADD_SUBSCRIPTION"
+    CLOSE_SUBSCRIPTION = "CLOSE_SUBSCRIPTION"
+    CLOSE = "CLOSE"
+
+
+class RelayShard:
+    """ A worker process that connects to a subset of relays
+
+    The worker parses, verifies and filters messages for its relays and sends
+    them to the coordinator in batches over `results`; a None in `results`
+    means the worker has finished. Messages published before a relay's
+    connection opens are sent once it does; failed sends come back as notices.
+    """
+    def __init__(
+            self,
+            relays: "list[Relay]",
+            results: multiprocessing.Queue,
+            ssl_options: dict=None,
+            batch_size: int=256,
+            flush_interval: float=0.05,
+            context=None) -> None:
+        context = context or multiprocessing.get_context()
+        self.urls = [relay.url for relay in relays]
+        self.commands = context.Queue()
+        relay_specs = [
+            (relay.url, relay.policy.should_read, relay.policy.should_write, dict(relay.subscriptions))
+            for relay in relays
+        ]
+        self.process = context.Process(
+            target=_run_shard,
+            args=(relay_specs, ssl_options, self.commands, results, batch_size, flush_interval),
+            name=f"relay-shard-{'-'.join(self.urls)}",
+            daemon=True)
+
+    def start(self):
+        self.process.start()
+
+    def is_alive(self) -> bool:
+        return self.process.is_alive()
+
+    def publish(self, message: str, url: str=None):
+        """ Sends to every writable relay in the shard, or only to `url` """
+        self.commands.put((ShardCommand.PUBLISH, message, url))
+
+    def add_subscription(self, id: str, filters: Filters, close_on_eose: bool=False):
+        self.commands.put((ShardCommand.ADD_SUBSCRIPTION, id, filters, close_on_eose))
+
+    def close_subscription(self, id: str):
+        self.commands.put((ShardCommand.CLOSE_SUBSCRIPTION, id))
+
+    def close(self):
+        self.commands.put((ShardCommand.CLOSE,))
+
+    def join(self, timeout: float=None):
+        self.process.join(timeout)
+
+
+class _ShardMessagePool(MessagePool):
+    """ Keeps reconcile replies for the coordinator, which owns the sessions """
+    def __init__(self) -> None:
+        super().__init__()
+        self.negentropy_messages: queue.Queue[NegentropyMessage] = queue.Queue()
+
+    def _add_negentropy_message(self, message: NegentropyMessage):
+        self.negentropy_messages.put(message)
+
+
+class _QueuedRelay(Relay):
+    """ Holds outgoing messages until the connection is open; failures become notices """
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._outbox: list[str] = []
+        self._is_open = False
+        self._outbox_lock = threading.Lock()
+
+    def publish(self, message: str):
+        with self._outbox_lock:
+            if not self._is_open:
+                self._outbox.append(message)
+                return
+            self._send(message)
+
+    def close(self):
+        super().close()
+        with self._outbox_lock:
+            for message in self._outbox:
+                self._notify(f"Could not publish to {self.url}: connection never opened: {message}")
+            self._outbox = []
+
+    def _on_open(self, class_obj):
+        with self._outbox_lock:
+            self._is_open = True
+            for message in self._outbox:
+                self._send(message)
+            self._outbox = []
+
+    def _on_close(self, class_obj, status_code, message):
+        with self._outbox_lock:
+            self._is_open = False
+
+    def _send(self, message: str):
+        try:
+            super().publish(message)
+        except Exception as e:
+            self._notify(f"Could not publish to {self.url}: {e!r}: {message}")
+
+    def _notify(self, content: str):
+        self.message_pool.notices.put(NoticeMessage(content, self.url))
+
+
+def _run_shard(relay_specs, ssl_options, commands, results, batch_size, flush_interval):
+    message_pool = _ShardMessagePool()
+    delegation_validator = DelegationValidator()
+    relays = [
+        _QueuedRelay(url, RelayPolicy(read, write), message_pool, subscriptions, delegation_validator)
+        for url, read, write, subscriptions in relay_specs
+    ]
+    for relay in relays:
+        threading.Thread(
+            target=relay.connect,
+            args=(ssl_options,),
+            name=f"{relay.url}-thread",
+            daemon=True
+        ).start()
+
+    stop = threading.Event()
+    forwarder = threading.Thread(
+        target=_forward_messages,
+        args=(message_pool, results, batch_size, flush_interval, stop),
+        name="shard-forwarder",
+        daemon=True)
+    forwarder.start()
+
+    while True:
+        command, *args = commands.get()
+        if command == ShardCommand.CLOSE:
+            break
+        for relay in relays:
+            if command == ShardCommand.PUBLISH:
+                message, url = args
+                if url == relay.url or (url is None and relay.policy.should_write):
+                    relay.publish(message)
+            elif command == ShardCommand.ADD_SUBSCRIPTION:
+                relay.add_subscription(*args)
+            elif command == ShardCommand.CLOSE_SUBSCRIPTION:
+                relay.close_subscription(args[0])
+
+    for relay in relays:
+        relay.close()
+    stop.set()
+    forwarder.join()
+    results.put(None)
+
+
+def _forward_messages(message_pool: _ShardMessagePool, results, batch_size: int, flush_interval: float, stop: threading.Event):
+    queues = (message_pool.events, message_pool.notices, message_pool.eose_notices, message_pool.negentropy_messages)
+    while True:
+        stopping = stop.is_set()
+        batch = []
+        for q in queues:
+            while len(batch) < batch_size:
+                try:
+                    batch.append(q.get_nowait())
+                except queue.Empty:
+                    break
+
+        if batch:
+            results.put(batch)
+        elif stopping:
+            return
+        else:
+            stop.wait(flush_interval)
@@ -1,4 +1,6 @@
+import json
 from .filter import Filters
+from .message_type import ClientMessageType
 
 class Subscription:
     def __init__(self, id: str, filters: Filters=None) -> None:
@@ -10,3 +12,8 @@ class Subscription:
             "id": self.id, 
             "filters": self.filters.to_json_array() 
         }
+
+    def to_message(self) -> str:
+        request = [ClientMessageType.REQUEST, self.id]
+        request.extend(self.filters.to_json_array())
+        return json.dumps(request)
@@ -0,0 +1,116 @@
+import random
+import time
+from collections import deque
+from threading import Lock
+from typing import Callable
+
+
+class TraceStage:
+    PARSE = "parse"
+    EVENT = "event"
+    VERIFY = "verify"
+    DELEGATION = "delegation"
+    FILTER = "filter"
+    POOL_PARSE = "pool_parse"
+    DEDUP_LOCK = "dedup_lock"
+    DEDUP = "dedup"
+    QUEUE_WAIT = "queue_wait"
+    TOTAL = "total"
+
+
+class LatencyHistogram:
+    """ Keeps the most recent `max_samples` latencies (in seconds) plus the all-time max """
+    def __init__(self, max_samples: int=10000) -> None:
+        self.samples: deque[float] = deque(maxlen=max_samples)
+        self.count = 0
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        self.samples.append(seconds)
+        self.count += 1
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q: float) -> float:
+        samples = sorted(self.samples)
+        if not samples:
+            return 0.0
+        return samples[min(int(q / 100 * len(samples)), len(samples) - 1)]
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "p50": self.percentile(50),
+            "p99": self.percentile(99),
+            "max": self.max,
+        }
+
+
+class MessageTrace:
+    """ Timestamps one sampled message as it moves through the ingest stages """
+    def __init__(self, tracer: "LatencyTracer", url: str) -> None:
+        self.tracer = tracer
+        self.url = url
+        self.started_at = time.perf_counter()
+        self.stages: list[tuple[str, float]] = []
+        self._last = self.started_at
+        self._finished = False
+
+    def mark(self, stage: str):
+        """ Records the time spent since the previous mark as `stage` """
+        now = time.perf_counter()
+        seconds = now - self._last
+        self._last = now
+        self.stages.append((stage, seconds))
+        self.tracer.record(self.url, stage, seconds)
+
+    def finish(self):
+        if self._finished:
+            return
+        self._finished = True
+        self.tracer.record(self.url, TraceStage.TOTAL, self._last - self.started_at)
+        self.tracer.finish(self)
+
+
+class LatencyTracer:
+    """ Opt-in sampled latency tracing for messages received from relays
+
+    A `sample_rate` fraction of messages is traced; per-relay, per-stage latency
+    histograms are available from `stats()`. Hooks added with `add_hook` are
+    called with every finished MessageTrace, e.g. to forward it to an external
+    tracer.
+    """
+    def __init__(self, sample_rate: float=0.01, max_samples: int=10000) -> None:
+        self.sample_rate = sample_rate
+        self.max_samples = max_samples
+        self.histograms: dict[str, dict[str, LatencyHistogram]] = {}
+        self.hooks: list[Callable[[MessageTrace], None]] = []
+        self.lock = Lock()
+
+    def add_hook(self, hook: Callable[[MessageTrace], None]):
+        self.hooks.append(hook)
+
+    def start(self, url: str) -> MessageTrace:
+        """ Returns a MessageTrace if this message is sampled, otherwise None """
+        if random.random() >= self.sample_rate:
+            return None
+        return MessageTrace(self, url)
+
+    def record(self, url: str, stage: str, seconds: float):
+        with self.lock:
+            stages = self.histograms.setdefault(url, {})
+            if stage not in stages:
+                stages[stage] = LatencyHistogram(self.max_samples)
+            stages[stage].add(seconds)
+
+    def finish(self, trace: MessageTrace):
+        for hook in self.hooks:
+            hook(trace)
+
+    def stats(self) -> dict:
+        """ {url: {stage: {"count", "p50", "p99", "max"}}} with latencies in seconds """
+        with self.lock:
+            return {
+                url: {stage: histogram.summary() for stage, histogram in stages.items()}
+                for url, stages in self.histograms.items()
+            }
@@ -0,0 +1,19 @@
+import json
+from nostr.event import Event
+from nostr.key import PrivateKey
+
+
+def to_relay_message(event: Event, subscription_id: str="sub") -> str:
+    """ The ["EVENT", <subscription_id>, <event>] message a relay would send """
+    return json.dumps(["EVENT", subscription_id, json.loads(event.to_message())[1]])
+
+
+def make_signed_events(n: int, private_key: PrivateKey=None, created_at: int=1_600_000_000) -> "list[Event]":
+    """ `n` signed text notes one second apart """
+    private_key = private_key or PrivateKey()
+    events = []
+    for i in range(n):
+        event = Event(private_key.public_key.hex(), f"note {i}", created_at=created_at + i)
+        private_key.sign_event(event)
+        events.append(event)
+    return events
@@ -0,0 +1,70 @@
+import json
+import time
+from conftest import to_relay_message
+from nostr.checkpoint import SubscriptionCheckpoints
+from nostr.event import Event
+from nostr.filter import Filter, Filters
+from nostr.key import PrivateKey
+from nostr.message_pool import MessagePool
+
+URL = "wss://relay.example"
+
+
+def test_checkpoint_only_advances_after_eose(tmp_path):
+    """ stored events arrive newest-first, so progress is committed at EOSE """
+    checkpoints = SubscriptionCheckpoints(str(tmp_path / "checkpoints.db"))
+    checkpoints.start(URL, "sub")
+    checkpoints.update(URL, "sub", 500)
+    checkpoints.update(URL, "sub", 300)
+    assert checkpoints.get(URL, "sub") == (None, False)
+
+    checkpoints.mark_eose(URL, "sub")
+    assert checkpoints.get(URL, "sub") == (500, True)
+
+    # live events after EOSE keep moving the checkpoint forward
+    checkpoints.update(URL, "sub", 600)
+    assert checkpoints.get(URL, "sub") == (600, True)
+
+    # a new REQ starts another stored phase without losing the resume point
+    checkpoints.start(URL, "sub")
+    checkpoints.update(URL, "sub", 900)
+    assert checkpoints.get(URL, "sub") == (600, False)
+
+
+def test_resume_after_restart(tmp_path):
+    """ checkpoints recorded through the MessagePool survive a restart and adjust `since` """
+    path = str(tmp_path / "checkpoints.db")
+    checkpoints = SubscriptionCheckpoints(path, overlap_secs=60)
+    message_pool = MessagePool(checkpoints=checkpoints)
+
+    pk = PrivateKey().public_key.hex()
+    checkpoints.start(URL, "sub")
+    for created_at in (2000, 1000):
+        message_pool.add_message(to_relay_message(Event(pk, "hi", created_at=created_at)), URL)
+    message_pool.add_message(json.dumps(["EOSE", "sub"]), URL)
+    checkpoints.close()
+
+    checkpoints = SubscriptionCheckpoints(path, overlap_secs=60)
+    assert checkpoints.get(URL, "sub") == (2000, True)
+
+    filters = Filters([Filter(kinds=[1]), Filter(kinds=[0], since=5000)])
+    resumed = checkpoints.resume_filters(URL, "sub", filters)
+    assert [f.since for f in resumed] == [1940, 5000]
+    assert filters[0].since is None
+    assert checkpoints.resume_filters("wss://other.example", "sub", filters) is filters
+
+
+def test_future_timestamps_are_clamped(tmp_path, monkeypatch):
+    """ a future created_at must not move the checkpoint past the time it was received """
+    monkeypatch.setattr(time, "time", lambda: 1_700_000_000)
+    checkpoints = SubscriptionCheckpoints(str(tmp_path / "checkpoints.db"))
+
+    checkpoints.start(URL, "sub")
+    checkpoints.update(URL, "sub", 9999999999)
+    checkpoints.mark_eose(URL, "sub")
+    assert checkpoints.get(URL, "sub") == (1_700_000_000, True)
+
+    # 15 minutes ahead of the clock, received a minute later
+    monkeypatch.setattr(time, "time", lambda: 1_700_000_060)
+    checkpoints.update(URL, "sub", 1_700_000_960)
+    assert checkpoints.get(URL, "sub") == (1_700_000_060, True)
@@ -0,0 +1,73 @@
+import time
+from nostr.delegation import Delegation, DelegationValidator
+from nostr.event import Event, EventKind
+from nostr.key import PrivateKey
+
+
+def make_delegation(identity_pk: PrivateKey, delegatee_pk: PrivateKey, duration_secs: int=3600) -> Delegation:
+    delegation = Delegation(
+        delegator_pubkey=identity_pk.public_key.hex(),
+        delegatee_pubkey=delegatee_pk.public_key.hex(),
+        event_kind=EventKind.TEXT_NOTE,
+        duration_secs=duration_secs,
+    )
+    identity_pk.sign_delegation(delegation)
+    return delegation
+
+
+def test_conditions_are_fixed(monkeypatch):
+    """ conditions should not change between accesses """
+    monkeypatch.setattr(time, "time", lambda: 1000)
+    delegation = Delegation("a" * 64, "b" * 64, EventKind.TEXT_NOTE, duration_secs=60)
+    conditions = delegation.conditions
+    assert conditions == f"kind={EventKind.TEXT_NOTE}&created_at<1060"
+
+    monkeypatch.setattr(time, "time", lambda: 5000)
+    assert delegation.conditions == conditions
+
+    delegation = Delegation("a" * 64, "b" * 64, EventKind.TEXT_NOTE, expires=1234)
+    assert delegation.conditions == f"kind={EventKind.TEXT_NOTE}&created_at<1234"
+
+
+def test_validate_delegated_event():
+    """ validate should accept a properly delegated event and reject mismatches """
+    identity_pk, delegatee_pk = PrivateKey(), PrivateKey()
+    delegation = make_delegation(identity_pk, delegatee_pk)
+    validator = DelegationValidator()
+
+    event = Event(delegatee_pk.public_key.hex(), "Hello, NIP-26!", tags=[delegation.get_tag()])
+    assert validator.validate(event)
+
+    # Not covered by the kind condition
+    event = Event(delegatee_pk.public_key.hex(), "", kind=EventKind.SET_METADATA, tags=[delegation.get_tag()])
+    assert not validator.validate(event)
+
+    # Created after the delegation expired
+    event = Event(delegatee_pk.public_key.hex(), "late", created_at=delegation.expires + 1, tags=[delegation.get_tag()])
+    assert not validator.validate(event)
+
+    # Signed by someone other than the delegatee
+    event = Event(PrivateKey().public_key.hex(), "imposter", tags=[delegation.get_tag()])
+    assert not validator.validate(event)
+
+    # Events without a delegation tag are unaffected
+    assert validator.validate(Event(delegatee_pk.public_key.hex(), "plain"))
+
+
+def test_validation_cache_is_bounded():
+    """ the token signature is cached once per delegation, up to max_cache_size """
+    identity_pk = PrivateKey()
+    validator = DelegationValidator(max_cache_size=2)
+
+    delegatee_pk = PrivateKey()
+    delegation = make_delegation(identity_pk, delegatee_pk)
+    for i in range(5):
+        event = Event(delegatee_pk.public_key.hex(), f"note {i}", tags=[delegation.get_tag()])
+        assert validator.validate(event)
+    assert len(validator._cache) == 1
+
+    for _ in range(3):
+        delegatee_pk = PrivateKey()
+        delegation = make_delegation(identity_pk, delegatee_pk)
+        assert validator.validate(Event(delegatee_pk.public_key.hex(), "hi", tags=[delegation.get_tag()]))
+    assert len(validator._cache) == 2
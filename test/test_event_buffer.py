@@ -0,0 +1,59 @@
+import pytest
+from nostr.event import Event, EventKind
+from nostr.filter import Filter, Filters
+from nostr.key import PrivateKey
+
+np = pytest.importorskip("numpy")
+from nostr.event_buffer import EventBuffer
+
+
+def make_events(n: int):
+    pk1, pk2 = PrivateKey(), PrivateKey()
+    events = []
+    for i in range(n):
+        pk = pk1 if i % 2 == 0 else pk2
+        kind = EventKind.TEXT_NOTE if i % 3 else EventKind.SET_METADATA
+        event = Event(pk.public_key.hex(), f"note {i} ✨", created_at=1000 + i, kind=kind, tags=[["t", str(i % 4)]])
+        pk.sign_event(event)
+        events.append(event)
+    return events
+
+
+def test_roundtrip():
+    """ Events read back from the buffer should equal the originals and still verify """
+    events = make_events(50)
+    buffer = EventBuffer(capacity=4)
+    buffer.extend(events)
+
+    assert len(buffer) == 50
+    for original, stored in zip(events, buffer):
+        assert stored.id == original.id
+        assert stored.public_key == original.public_key
+        assert stored.signature == original.signature
+        assert stored.content == original.content
+        assert stored.tags == original.tags
+        assert stored.verify()
+    assert buffer[-1].id == events[-1].id
+
+
+def test_mask_agrees_with_filter_matches():
+    """ Vectorized masks should select exactly what Filter.matches selects """
+    events = make_events(60)
+    buffer = EventBuffer.from_events(events)
+
+    filters = [
+        Filter(kinds=[EventKind.TEXT_NOTE]),
+        Filter(authors=[events[1].public_key], since=1010, until=1040),
+        Filter(ids=[events[3].id, events[7].id, "abc"]),
+        Filter(ids=[events[4].id.upper(), events[5].id[:10].upper() + events[5].id[10:]]),
+        Filter(authors=[events[0].public_key.upper()]),
+        Filter(kinds=[EventKind.SET_METADATA], tags={"#t": ["0", "2"]}),
+        Filter(authors=["00" * 32]),
+    ]
+    for filter in filters:
+        expected = [filter.matches(e) for e in events]
+        assert buffer.mask(filter).tolist() == expected
+
+    mask = buffer.match(Filters(filters[1:3]))
+    expected_ids = [e.id for e in events if filters[1].matches(e) or filters[2].matches(e)]
+    assert [e.id for e in buffer.events(mask)] == expected_ids
@@ -0,0 +1,118 @@
+from conftest import to_relay_message
+from nostr.event import Event, EventKind
+from nostr.event_state import EventState
+from nostr.key import PrivateKey
+from nostr.message_pool import MessagePool
+
+
+def drain(message_pool: MessagePool) -> "list[Event]":
+    events = []
+    while message_pool.has_events():
+        events.append(message_pool.get_event().event)
+    return events
+
+
+def test_keeps_newest_replaceable_event():
+    """ older versions of a replaceable event should not reach consumers """
+    pk = PrivateKey().public_key.hex()
+    state = EventState()
+    message_pool = MessagePool(state)
+
+    newer = Event(pk, '{"name": "new"}', created_at=200, kind=EventKind.SET_METADATA)
+    older = Event(pk, '{"name": "old"}', created_at=100, kind=EventKind.SET_METADATA)
+    message_pool.add_message(to_relay_message(newer), "wss://a")
+    message_pool.add_message(to_relay_message(older), "wss://b")
+
+    assert [e.id for e in drain(message_pool)] == [newer.id]
+    assert state.get_latest_id(pk, EventKind.SET_METADATA) == newer.id
+
+
+def test_parameterized_replaceable_uses_d_tag():
+    """ each d tag is replaced independently """
+    pk = PrivateKey().public_key.hex()
+    state = EventState()
+
+    a1 = Event(pk, "a1", created_at=100, kind=30000, tags=[["d", "a"]])
+    b1 = Event(pk, "b1", created_at=100, kind=30000, tags=[["d", "b"]])
+    a2 = Event(pk, "a2", created_at=200, kind=30000, tags=[["d", "a"]])
+    assert state.process(a1)
+    assert state.process(b1)
+    assert state.process(a2)
+    assert not state.process(Event(pk, "a0", created_at=50, kind=30000, tags=[["d", "a"]]))
+
+    assert state.get_latest_id(pk, 30000, "a") == a2.id
+    assert state.get_latest_id(pk, 30000, "b") == b1.id
+
+
+def test_deletions():
+    """ events deleted by their author are suppressed, even if they arrive after the deletion """
+    pk = PrivateKey().public_key.hex()
+    other_pk = PrivateKey().public_key.hex()
+    state = EventState()
+
+    note = Event(pk, "oops", created_at=100)
+    others_note = Event(other_pk, "not yours", created_at=100)
+    contacts = Event(pk, "", created_at=100, kind=EventKind.CONTACTS)
+    assert state.process(contacts)
+
+    deletion = Event(
+        pk, "",
+        created_at=150,
+        kind=EventKind.DELETE,
+        tags=[["e", note.id], ["e", others_note.id], ["a", f"{EventKind.CONTACTS}:{pk}:"]],
+    )
+    assert state.process(deletion)
+
+    assert not state.process(note)
+    assert state.process(others_note)
+    assert state.get_latest_id(pk, EventKind.CONTACTS) is None
+    assert not state.process(Event(pk, "", created_at=120, kind=EventKind.CONTACTS))
+    assert state.process(Event(pk, "", created_at=160, kind=EventKind.CONTACTS))
+
+
+def test_third_party_deletion_does_not_undo_authors_deletion():
+    """ a kind-5 from someone else must not override the author's own deletion """
+    pk = PrivateKey().public_key.hex()
+    attacker_pk = PrivateKey().public_key.hex()
+    state = EventState()
+
+    note = Event(pk, "deleted", created_at=100)
+    assert state.process(Event(pk, "", created_at=150, kind=EventKind.DELETE, tags=[["e", note.id]]))
+    assert state.process(Event(attacker_pk, "", created_at=160, kind=EventKind.DELETE, tags=[["e", note.id]]))
+    assert not state.process(note)
+
+    # and the attacker's deletion alone doesn't remove someone else's note
+    other_note = Event(pk, "kept", created_at=100)
+    assert state.process(Event(attacker_pk, "", created_at=160, kind=EventKind.DELETE, tags=[["e", other_note.id]]))
+    assert state.process(other_note)
+
+
+def test_address_deletion_ignores_d_tag_on_plain_replaceable_kinds():
+    """ a stray d tag on a kind-0 event must not escape an "0:<pubkey>:" deletion """
+    pk = PrivateKey().public_key.hex()
+    state = EventState()
+
+    deletion = Event(pk, "", created_at=150, kind=EventKind.DELETE, tags=[["a", f"{EventKind.SET_METADATA}:{pk}:"]])
+    assert state.process(deletion)
+    assert not state.process(Event(pk, "{}", created_at=100, kind=EventKind.SET_METADATA, tags=[["d", "x"]]))
+
+    # an address naming a d value still applies to the plain replaceable event
+    state = EventState()
+    metadata = Event(pk, "{}", created_at=100, kind=EventKind.SET_METADATA)
+    assert state.process(metadata)
+    assert state.process(Event(pk, "", created_at=150, kind=EventKind.DELETE, tags=[["a", f"{EventKind.SET_METADATA}:{pk}:x"]]))
+    assert state.get_latest_id(pk, EventKind.SET_METADATA) is None
+
+
+def test_state_is_bounded():
+    """ each table keeps at most max_entries, evicting the least recently used """
+    state = EventState(max_entries=3)
+    pks = [PrivateKey().public_key.hex() for _ in range(5)]
+    for pk in pks:
+        assert state.process(Event(pk, "{}", created_at=100, kind=EventKind.SET_METADATA))
+        assert state.process(Event(pk, "", created_at=100, kind=EventKind.DELETE, tags=[["e", pk]]))
+
+    assert len(state._latest) == len(state._latest_keys) == 3
+    assert len(state._deleted_ids) == 3
+    assert state.get_latest_id(pks[0], EventKind.SET_METADATA) is None
+    assert state.get_latest_id(pks[-1], EventKind.SET_METADATA) is not None
@@ -0,0 +1,224 @@
+import json
+import pytest
+import secrets
+import threading
+from conftest import make_signed_events, to_relay_message
+from nostr.event import Event
+from nostr.filter import Filter, Filters
+from nostr.negentropy import Negentropy
+from nostr.relay_manager import RelayManager, RelayException
+
+
+class StandInRelay:
+    """ In-memory relay that answers REQ/CLOSE and RECONCILE-OPEN/RECONCILE-MSG/RECONCILE-CLOSE """
+    def __init__(self, events: "list[Event]") -> None:
+        self.events = events
+        self.sessions: dict[str, Negentropy] = {}
+        self.received: list[tuple[str, str]] = []
+        self.negentropy_bytes = 0
+
+    def handle(self, message: str) -> "list[str]":
+        self.negentropy_bytes += len(message) if message.startswith('["RECONCILE') else 0
+        message_type, subscription_id, *args = json.loads(message)
+        self.received.append((message_type, subscription_id))
+
+        if message_type == "REQ":
+            matches = [e for e in self.events if any(to_filter(f).matches(e) for f in args)]
+            replies = [to_relay_message(e, subscription_id) for e in matches]
+            return replies + [json.dumps(["EOSE", subscription_id])]
+        if message_type == "CLOSE":
+            return []
+
+        if message_type == "RECONCILE-OPEN":
+            filter_json, initial_message = args
+            matches = [e for e in self.events if to_filter(filter_json).matches(e)]
+            self.sessions[subscription_id] = Negentropy.from_events(matches, is_initiator=False)
+            reply = self.sessions[subscription_id].reconcile(initial_message)
+        elif message_type == "RECONCILE-MSG":
+            if subscription_id not in self.sessions:
+                return [json.dumps(["RECONCILE-ERR", subscription_id, "closed: unknown subscription"])]
+            reply = self.sessions[subscription_id].reconcile(args[0])
+        elif message_type == "RECONCILE-CLOSE":
+            self.sessions.pop(subscription_id, None)
+            return []
+
+        reply_message = json.dumps(["RECONCILE-MSG", subscription_id, reply])
+        self.negentropy_bytes += len(reply_message)
+        return [reply_message]
+
+
+def to_filter(filter_json: dict) -> Filter:
+    return Filter(
+        ids=filter_json.get("ids"),
+        kinds=filter_json.get("kinds"),
+        authors=filter_json.get("authors"),
+        since=filter_json.get("since"),
+        until=filter_json.get("until"),
+    )
+
+
+def random_items(n: int) -> "list[tuple[int, str]]":
+    return [(1_600_000_000 + i, secrets.token_hex(32)) for i in range(n)]
+
+
+def sync(client: Negentropy, server: Negentropy) -> int:
+    """ Runs the exchange in memory and returns the number of bytes sent """
+    message = client.initiate()
+    sent = len(json.dumps(message))
+    while True:
+        reply = server.reconcile(message)
+        sent += len(json.dumps(reply))
+        message = client.reconcile(reply)
+        if not message:
+            return sent
+        sent += len(json.dumps(message))
+
+
+def test_reconcile_finds_differences():
+    """ have_ids/need_ids should be exactly the symmetric difference """
+    shared = random_items(5000)
+    only_client = random_items(4)
+    only_server = random_items(7)
+    client = Negentropy(shared + only_client)
+    server = Negentropy(shared + only_server, is_initiator=False)
+
+    sent = sync(client, server)
+    assert client.have_ids == {id for _, id in only_client}
+    assert client.need_ids == {id for _, id in only_server}
+
+    # a plain REQ would move every id at least once
+    assert sent < 5000 * 64 / 4
+
+
+def test_reconcile_identical_and_empty_sets():
+    items = random_items(300)
+    client = Negentropy(items)
+    sync(client, Negentropy(items, is_initiator=False))
+    assert client.have_ids == client.need_ids == set()
+
+    client = Negentropy([])
+    sync(client, Negentropy(items, is_initiator=False))
+    assert client.need_ids == {id for _, id in items}
+
+
+URL = "wss://relay.example"
+
+
+def connect_stand_in(stand_in) -> RelayManager:
+    """ RelayManager whose relay at URL hands every published message to `stand_in` """
+    relay_manager = RelayManager()
+    relay_manager.add_relay(URL, subscriptions={})
+    relay = relay_manager.relays[URL]
+    relay.publish = lambda message: [relay._on_message(None, reply) for reply in stand_in.handle(message)]
+    return relay_manager
+
+
+def test_relay_manager_reconcile_fetches_missing_events():
+    """ RelayManager.reconcile should sync against a relay, REQ only the missing events and then CLOSE that REQ """
+    events = make_signed_events(120)
+    stand_in = StandInRelay(events)
+    relay_manager = connect_stand_in(stand_in)
+
+    local_events = events[:50] + events[55:]
+    negentropy = relay_manager.reconcile(URL, "sync", Filter(authors=[events[0].public_key]), local_events)
+
+    missing_ids = {e.id for e in events[50:55]}
+    assert negentropy.need_ids == missing_ids
+    assert negentropy.have_ids == set()
+    assert stand_in.sessions == {}
+
+    fetched = set()
+    while relay_manager.message_pool.has_events():
+        fetched.add(relay_manager.message_pool.get_event().event.id)
+    assert fetched == missing_ids
+
+    assert stand_in.received[-3:] == [("RECONCILE-CLOSE", "sync"), ("REQ", "sync"), ("CLOSE", "sync")]
+    assert "sync" not in relay_manager.relays[URL].subscriptions
+
+
+def test_reconcile_refuses_subscription_in_use():
+    """ fetching must not replace an existing subscription """
+    relay_manager = connect_stand_in(StandInRelay([]))
+    relay_manager.add_subscription("sync", Filters([Filter()]))
+    with pytest.raises(RelayException) as e:
+        relay_manager.reconcile(URL, "sync", Filter(), [])
+    assert "already exists" in str(e)
+
+
+@pytest.mark.parametrize("reply, error", [
+    (["RECONCILE-ERR", "sync", "blocked: no"], "blocked: no"),
+    (["RECONCILE-MSG", "sync", [[None, "bogus", None]]], "malformed reply"),
+    (["RECONCILE-MSG", "sync", 5], "malformed reply"),
+])
+def test_reconcile_errors_close_the_session(reply, error):
+    """ relay errors and malformed replies raise RelayException and still send RECONCILE-CLOSE """
+    class BrokenRelay:
+        received = []
+        def handle(self, message: str) -> "list[str]":
+            self.received.append(json.loads(message)[0])
+            return [json.dumps(reply)] if self.received[-1] == "RECONCILE-OPEN" else []
+
+    broken = BrokenRelay()
+    relay_manager = connect_stand_in(broken)
+    with pytest.raises(RelayException) as e:
+        relay_manager.reconcile(URL, "sync", Filter(), make_signed_events(3))
+    assert error in str(e)
+    assert broken.received == ["RECONCILE-OPEN", "RECONCILE-CLOSE"]
+
+
+def test_reconcile_timeout_closes_the_session():
+    class SilentRelay:
+        received = []
+        def handle(self, message: str) -> "list[str]":
+            self.received.append(json.loads(message)[0])
+            return []
+
+    silent = SilentRelay()
+    relay_manager = connect_stand_in(silent)
+    with pytest.raises(RelayException) as e:
+        relay_manager.reconcile(URL, "sync", Filter(), [], timeout=0.05)
+    assert "timed out" in str(e)
+    assert silent.received == ["RECONCILE-OPEN", "RECONCILE-CLOSE"]
+
+    # a late reply with no open session is dropped, not queued
+    relay_manager.message_pool.add_message(json.dumps(["RECONCILE-MSG", "sync", []]), URL)
+    assert relay_manager.message_pool._negentropy_sessions == {}
+
+
+def test_concurrent_reconciliations_get_their_own_replies():
+    """ replies are routed per (url, subscription id), so parallel syncs don't steal each other's messages """
+    events = make_signed_events(60)
+
+    relay_manager = RelayManager()
+    stand_ins = {"wss://a.example": StandInRelay(events[:40]), "wss://b.example": StandInRelay(events[20:])}
+    for url, stand_in in stand_ins.items():
+        relay_manager.add_relay(url, subscriptions={})
+        relay = relay_manager.relays[url]
+
+        def deliver(message: str, relay=relay, stand_in=stand_in):
+            for reply in stand_in.handle(message):
+                relay._on_message(None, reply)
+
+        # reply from another thread so the sessions' messages interleave
+        relay.publish = lambda message, deliver=deliver: threading.Thread(target=deliver, args=(message,)).start()
+
+    jobs = [("wss://a.example", "sync"), ("wss://a.example", "sync2"), ("wss://b.example", "sync")]
+    results, errors = {}, []
+    def run(url: str, id: str):
+        try:
+            results[(url, id)] = relay_manager.reconcile(url, id, Filter(), events[10:50], fetch=False, timeout=5)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=job) for job in jobs]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    for id in ("sync", "sync2"):
+        assert results[("wss://a.example", id)].need_ids == {e.id for e in events[:10]}
+        assert results[("wss://a.example", id)].have_ids == {e.id for e in events[40:50]}
+    assert results[("wss://b.example", "sync")].need_ids == {e.id for e in events[50:]}
+    assert results[("wss://b.example", "sync")].have_ids == {e.id for e in events[10:20]}
@@ -1,9 +1,113 @@
+import base64
+import json
 import pytest
+import socket
+import struct
+import threading
+import time
+from conftest import make_signed_events
+from hashlib import sha1
 from nostr.event import Event
+from nostr.filter import Filter, Filters
 from nostr.key import PrivateKey
+from nostr.message_pool import EventMessage
 from nostr.relay_manager import RelayManager, RelayException
 
 
+class LocalRelay:
+    """ Minimal websocket relay on localhost that answers REQ with its stored events and EOSE """
+    def __init__(self, events: "list[Event]") -> None:
+        self.events = events
+        self.connections = 0
+        self.requests = 0
+        self.server = socket.create_server(("127.0.0.1", 0))
+        self.url = f"ws://127.0.0.1:{self.server.getsockname()[1]}"
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def close(self):
+        self.server.close()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn: socket.socket):
+        with conn:
+            request = b""
+            while b"\r\n\r\n" not in request:
+                request += conn.recv(4096)
+            key = [line.split(b":", 1)[1].strip() for line in request.split(b"\r\n") if line.lower().startswith(b"sec-websocket-key")][0]
+            accept = base64.b64encode(sha1(key + b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11").digest())
+            conn.sendall(b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\nSec-WebSocket-Accept: " + accept + b"\r\n\r\n")
+            self.connections += 1
+
+            while True:
+                frame = self._recv_frame(conn)
+                if frame is None:
+                    return
+                message_type, subscription_id, *_ = json.loads(frame)
+                if message_type == "REQ":
+                    self.requests += 1
+                    for event in self.events:
+                        self._send_frame(conn, json.dumps(["EVENT", subscription_id, json.loads(event.to_message())[1]]))
+                    self._send_frame(conn, json.dumps(["EOSE", subscription_id]))
+
+    @staticmethod
+    def _recv_exactly(conn: socket.socket, n: int) -> bytes:
+        data = b""
+        while len(data) < n:
+            chunk = conn.recv(n - len(data))
+            if not chunk:
+                raise ConnectionError
+            data += chunk
+        return data
+
+    def _recv_frame(self, conn: socket.socket) -> str:
+        """ Returns the next text frame, or None once the client closes """
+        while True:
+            try:
+                b1, b2 = self._recv_exactly(conn, 2)
+                length = b2 & 0x7f
+                if length == 126:
+                    length, = struct.unpack(">H", self._recv_exactly(conn, 2))
+                elif length == 127:
+                    length, = struct.unpack(">Q", self._recv_exactly(conn, 8))
+                mask = self._recv_exactly(conn, 4) if b2 & 0x80 else b"\0\0\0\0"
+                payload = bytes(b ^ mask[i % 4] for i, b in enumerate(self._recv_exactly(conn, length)))
+            except (ConnectionError, OSError):
+                return None
+
+            opcode = b1 & 0x0f
+            if opcode == 0x8:
+                return None
+            if opcode == 0x1:
+                return payload.decode()
+
+    @staticmethod
+    def _send_frame(conn: socket.socket, text: str):
+        payload = text.encode()
+        if len(payload) < 126:
+            header = struct.pack(">BB", 0x81, len(payload))
+        elif len(payload) < 2**16:
+            header = struct.pack(">BBH", 0x81, 126, len(payload))
+        else:
+            header = struct.pack(">BBQ", 0x81, 127, len(payload))
+        conn.sendall(header + payload)
+
+
+def wait_for(condition, timeout: float=10) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
 def test_only_relay_valid_events():
     """ publish_event raise a RelayException if an Event fails verification """
     pk = PrivateKey()
@@ -28,3 +132,72 @@ def test_only_relay_valid_events():
     # Properly signed Event can be relayed
     pk.sign_event(event)
     relay_manager.publish_event(event)
+
+
+def test_sharded_connections_dedup_across_processes():
+    """ events forwarded by different worker processes are deduplicated by the coordinator """
+    relay_manager = RelayManager()
+    relay_manager.add_relay("ws://127.0.0.1:1", subscriptions={})
+    relay_manager.add_relay("ws://127.0.0.1:2", subscriptions={})
+    relay_manager.open_connections(num_processes=2)
+    assert len(relay_manager._shards) == 2
+
+    event, = make_signed_events(1)
+
+    # Stand in for two workers that both received the same event
+    relay_manager._shard_results.put([
+        EventMessage(event, "sub", "ws://127.0.0.1:1"),
+        EventMessage(event, "sub", "ws://127.0.0.1:2"),
+    ])
+    for _ in range(50):
+        if relay_manager.message_pool.has_events():
+            break
+        time.sleep(0.1)
+
+    # neither relay ever connects, so the worker reports the message it couldn't send
+    relay_manager.publish_message('["CLOSE", "sub"]')
+    relay_manager.close_connections()
+    assert relay_manager._shards == []
+
+    assert relay_manager.message_pool.get_event().event.id == event.id
+    assert not relay_manager.message_pool.has_events()
+
+    notices = []
+    while relay_manager.message_pool.has_notices():
+        notices.append(relay_manager.message_pool.get_notice())
+    assert sorted(notice.url for notice in notices) == ["ws://127.0.0.1:1", "ws://127.0.0.1:2"]
+    assert all("connection never opened" in notice.content for notice in notices)
+
+
+def test_sharded_workers_forward_events_and_eose():
+    """ worker processes connect, receive the forwarded REQ, verify/filter events and forward them with EOSE """
+    pk = PrivateKey()
+    events = make_signed_events(3, pk) + make_signed_events(1)
+    relays = [LocalRelay(events[:3]), LocalRelay(events[1:])]
+
+    relay_manager = RelayManager()
+    for relay in relays:
+        relay_manager.add_relay(relay.url, subscriptions={})
+    relay_manager.add_subscription("sub", Filters([Filter(authors=[pk.public_key.hex()])]))
+    relay_manager.open_connections(num_processes=2)
+    try:
+        # sent before the workers have connected; each worker holds it until its connection opens
+        relay_manager.request_subscription("sub")
+
+        eose_urls = set()
+        def received_eose_from_both() -> bool:
+            while relay_manager.message_pool.has_eose_notices():
+                eose_urls.add(relay_manager.message_pool.get_eose_notice().url)
+            return eose_urls == {relay.url for relay in relays}
+        assert wait_for(received_eose_from_both)
+        assert [relay.requests for relay in relays] == [1, 1]
+    finally:
+        relay_manager.close_connections()
+        for relay in relays:
+            relay.close()
+
+    received = []
+    while relay_manager.message_pool.has_events():
+        received.append(relay_manager.message_pool.get_event().event.id)
+    # other_pk's event is filtered out in the worker, the overlap is deduplicated by the coordinator
+    assert sorted(received) == sorted(e.id for e in events[:3])
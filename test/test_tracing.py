@@ -0,0 +1,55 @@
+import json
+from nostr.event import Event
+from nostr.filter import Filter, Filters
+from nostr.key import PrivateKey
+from nostr.message_pool import MessagePool
+from nostr.relay import Relay, RelayPolicy
+from nostr.tracing import LatencyTracer, TraceStage
+
+
+def make_relay(tracer: LatencyTracer) -> Relay:
+    relay = Relay("wss://relay.example", RelayPolicy(), MessagePool(), {}, tracer=tracer)
+    relay.add_subscription("sub", Filters([Filter()]))
+    return relay
+
+
+def make_message() -> str:
+    pk = PrivateKey()
+    event = Event(pk.public_key.hex(), "traced")
+    pk.sign_event(event)
+    return json.dumps(["EVENT", "sub", json.loads(event.to_message())[1]])
+
+
+def test_traces_every_stage():
+    """ a sampled event should be timed at each ingest stage and reported to hooks """
+    tracer = LatencyTracer(sample_rate=1.0)
+    finished = []
+    tracer.add_hook(finished.append)
+    relay = make_relay(tracer)
+
+    message = make_message()
+    relay._on_message(None, message)
+    relay._on_message(None, message)  # duplicate, finished at dedup
+    assert len(finished) == 1
+
+    relay.message_pool.get_event()
+    assert len(finished) == 2
+    assert [stage for stage, _ in finished[1].stages] == [
+        TraceStage.PARSE, TraceStage.EVENT, TraceStage.VERIFY, TraceStage.DELEGATION, TraceStage.FILTER,
+        TraceStage.POOL_PARSE, TraceStage.DEDUP_LOCK, TraceStage.DEDUP, TraceStage.QUEUE_WAIT,
+    ]
+
+    stats = tracer.stats()["wss://relay.example"]
+    assert stats[TraceStage.TOTAL]["count"] == 2
+    assert stats[TraceStage.QUEUE_WAIT]["count"] == 1
+    summary = stats[TraceStage.VERIFY]
+    assert 0 < summary["p50"] <= summary["p99"] <= summary["max"]
+
+
+def test_sampling_disabled():
+    """ with a zero sample rate nothing is recorded """
+    tracer = LatencyTracer(sample_rate=0.0)
+    relay = make_relay(tracer)
+    relay._on_message(None, make_message())
+    relay.message_pool.get_event()
+    assert tracer.stats() == {}